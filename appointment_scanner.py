@@ -3,22 +3,33 @@ Scan for available appointments using specific APIs,
 send notifications via email or SMS, and manage appointment data.
 """
 
+import functools
 import logging
+import math
 import os
+import queue
+import signal
 import sys
+import threading
 import time
 import datetime
-import heapq
+import enum
 import smtplib
-from typing import Dict, List, Optional, NoReturn
+import sqlite3
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, NoReturn, Sequence, Tuple, Union
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from pathlib import Path
 
 import dotenv
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dateutil import parser
 from dateutil.tz import gettz
-from cachetools import cached, TTLCache
 from twilio.rest import Client
 from twilio.base.exceptions import TwilioRestException
 
@@ -28,10 +39,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger()
 
+# Local data directory, shared by the locations cache and appointment history
+DATA_DIR = Path("~/.ge_scanner").expanduser()
+
 # Cache configuration:
-CACHE_MAXSIZE = 100  # maxsize is the maximum number of items in the cache
 CACHE_TTL = 15 * 24 * 60 * 60  # 15 days # ttl is the time to live in seconds
-CACHE = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL)
+LOCATIONS_CACHE_PATH = DATA_DIR / "locations.json"
 
 # API parameters
 LIMIT = 5
@@ -46,13 +59,63 @@ LOCATIONS_API_URL = (
     "temporary=false&inviteOnly=false&operational=true&serviceName=Global+Entry"
 )
 
+# HTTP session configuration
+MAX_WORKERS = 32  # maximum number of concurrent appointment fetches
+POOL_CONNECTIONS = 8  # number of host pools to keep
+# Keep one connection per worker alive so that no fetch has to reconnect
+POOL_MAXSIZE = MAX_WORKERS
+SESSION = requests.Session()
+SESSION.headers.update(
+    {
+        "Accept-Encoding": "gzip",
+        "Connection": "keep-alive",
+        "User-Agent": "ge-scanner/1.0",
+    }
+)
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        max_retries=Retry(
+            total=3, backoff_factor=0.3, status_forcelist=(502, 503, 504)
+        ),
+    ),
+)
+
+# Timezone used when displaying appointments
+CST = gettz("America/Chicago")
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M CST"
+
 # Check Interval
-CHECK_INTERVAL = 60 * 15  # 15 minutes
+CHECK_INTERVAL = 60 * 15  # 15 minutes, the interval before any history
 ERROR_INTERVAL = 60  # 1 minute
+MIN_CHECK_INTERVAL = 60  # 1 minute
+MAX_CHECK_INTERVAL = 60 * 60  # 1 hour
+
+# Adaptive interval: exponential moving average of new appointments per check.
+# The interval goes geometrically from MAX_CHECK_INTERVAL at or below
+# QUIET_HIT_RATE to MIN_CHECK_INTERVAL at or above BUSY_HIT_RATE.
+HIT_RATE_DECAY = 0.9  # weight of the previous average
+QUIET_HIT_RATE = 0.05
+BUSY_HIT_RATE = 1.0
+# Starting average, chosen so that the first interval is CHECK_INTERVAL
+INITIAL_HIT_RATE = QUIET_HIT_RATE + (BUSY_HIT_RATE - QUIET_HIT_RATE) * (
+    math.log(MAX_CHECK_INTERVAL / CHECK_INTERVAL)
+    / math.log(MAX_CHECK_INTERVAL / MIN_CHECK_INTERVAL)
+)
+
+# Scanner control: SIGUSR1 triggers an immediate check, SIGTERM stops the scanner
+STOP_EVENT = threading.Event()
+WAKE_EVENT = threading.Event()
 
 # EMAIL configuration
 SMTP_SERVER = "smtp.gmail.com"  # SMTP server for Gmail
 SMTP_PORT = 587
+SMTP_TIMEOUT = 30  # seconds
+
+# Notifications are sent by a background worker so that slow sends never delay a check
+NOTIFICATION_QUEUE_MAXSIZE = 1024
 
 # Email credentials
 dotenv.load_dotenv()
@@ -66,17 +129,64 @@ AUTH_TOKEN = os.getenv("AUTH_TOKEN")  # Replace with your Twilio Auth Token
 TO_NUMBER = os.getenv("TO_NUMBER")  # Replace with the recipient's phone number
 FROM_NUMBER = os.getenv("FROM_NUMBER")  # Replace with your Twilio phone number
 
-appointment_history: Dict[int, List[str]] = {}
+# Appointment history configuration
+HISTORY_MAXLEN = 64  # number of notified appointments remembered per location
+HISTORY_PATH = DATA_DIR / "history.sqlite"
+# Appointment times are in the location's local time but are read as CST, so
+# allow for locations up to six hours behind Chicago (Hawaii) before expiring
+HISTORY_EXPIRY_GRACE = datetime.timedelta(hours=6)
+
+# Notified appointments per location, mapping the formatted start to its datetime
+appointment_history: Dict[int, Dict[str, datetime.datetime]] = {}
+# Average number of new appointments per check, per location
+hit_rates: Dict[int, float] = {}
+# ETag and Last-Modified of the last appointments response, per location
+response_validators: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+# Appointments decoded from the last full response, re-used after a 304
+last_appointments: Dict[int, List[Dict[str, str]]] = {}
+# Shared SMTP session, or None until the first notification is sent
+SMTP_SESSION: Optional[smtplib.SMTP] = None
+# Pending notifications, with the (location ID, formatted start) of the
+# appointments they announce; None tells the worker to stop
+notification_queue: "queue.Queue[Optional[Tuple[str, List[Tuple[int, str]]]]]" = (
+    queue.Queue(maxsize=NOTIFICATION_QUEUE_MAXSIZE)
+)
+# Appointments whose notification was sent, waiting to be saved to the history database
+delivered_appointments: "queue.SimpleQueue[Tuple[int, str]]" = queue.SimpleQueue()
 
 
-@cached(CACHE)
 def fetch_locations() -> Dict[str, Dict[str, str]]:
+    """
+    Returns location data organized by city, reading it from the on-disk
+    cache while that is fresher than CACHE_TTL and refreshing it otherwise.
+    """
+    try:
+        if time.time() - LOCATIONS_CACHE_PATH.stat().st_mtime < CACHE_TTL:
+            return orjson.loads(LOCATIONS_CACHE_PATH.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        pass  # missing or unreadable cache, fetch from the API instead
+
+    locations_by_city = download_locations()
+    if locations_by_city:
+        try:
+            LOCATIONS_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = LOCATIONS_CACHE_PATH.with_suffix(".tmp")
+            tmp_path.write_bytes(orjson.dumps(locations_by_city))
+            tmp_path.replace(LOCATIONS_CACHE_PATH)
+        except OSError as e:
+            logger.error("Error caching locations - %s", e)
+    return locations_by_city
+
+
+def download_locations() -> Dict[str, Dict[str, str]]:
     """Fetches location data from the API and organizes it by city."""
     try:
-        response = requests.get(LOCATIONS_API_URL, timeout=10)
+        response = SESSION.get(LOCATIONS_API_URL, timeout=10)
         response.raise_for_status()
-        return {loc["city"].strip().lower(): loc for loc in response.json()}
-    except requests.RequestException as e:
+        return {
+            normalize_city(loc["city"]): loc for loc in orjson.loads(response.content)
+        }
+    except (requests.RequestException, orjson.JSONDecodeError) as e:
         logger.error("Error fetching locations from API - %s", e)
         return {}
     except TimeoutError as err:
@@ -84,15 +194,50 @@ def fetch_locations() -> Dict[str, Dict[str, str]]:
         return {}
 
 
-def fetch_appointments(location_id: int) -> Optional[List[Dict[str, str]]]:
-    """Fetches the earliest available appointments for a given location."""
+def appointment_url(location_id: int) -> str:
+    """Builds the appointments API URL for a given location."""
+    return APPOINTMENTS_API_URL.format(LIMIT, location_id, MINIMUM)
+
+
+class FetchResult(enum.Enum):
+    """Outcomes of fetch_appointments other than freshly decoded appointments."""
+
+    NOT_MODIFIED = "not modified"  # unchanged since the last fetch
+
+
+def fetch_appointments(
+    location_id: int, url: Optional[str] = None
+) -> Union[List[Dict[str, str]], FetchResult, None]:
+    """
+    Fetches the earliest available appointments for a given location.
+    The URL can be precomputed with appointment_url() for repeated polls.
+    Returns FetchResult.NOT_MODIFIED if the appointments are unchanged since
+    the last fetch, and None on errors.
+    """
+    headers = {}
+    etag, last_modified = response_validators.get(location_id, (None, None))
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
     try:
-        response = requests.get(
-            APPOINTMENTS_API_URL.format(LIMIT, location_id, MINIMUM), timeout=10
+        response = SESSION.get(
+            url or appointment_url(location_id), headers=headers, timeout=10
         )
         response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
+        if response.status_code == 304:
+            return FetchResult.NOT_MODIFIED
+        if response.content.strip() == b"[]":
+            appointments = []  # no free slots, the common case for most locations
+        else:
+            appointments = orjson.loads(response.content)
+        last_appointments[location_id] = appointments
+        response_validators[location_id] = (
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+        return appointments
+    except (requests.RequestException, orjson.JSONDecodeError) as e:
         logger.error("Error for location ID %s - %s", location_id, e)
         return None
     except TimeoutError as err:
@@ -100,36 +245,153 @@ def fetch_appointments(location_id: int) -> Optional[List[Dict[str, str]]]:
         return None
 
 
-def process_appointments(location_id: int, city_name: str) -> bool:
-    """Processes appointments for a specific location."""
-    appointments = fetch_appointments(location_id)
+def process_appointments(
+    location_id: int,
+    city_name: str,
+    appointments: Optional[List[Dict[str, str]]],
+    history_db: sqlite3.Connection,
+    now: datetime.datetime,
+) -> List[Tuple[str, str]]:
+    """
+    Processes the fetched appointments for a specific location, keeping
+    only those in the year of `now`.
+    Returns the new appointments found, as (formatted start, city) pairs.
+    """
+    forget_appointments(history_db, location_id, expire_appointments(location_id, now))
     if not appointments:
         logger.info("No appointments found for %s", city_name)
-        return True
-
-    if location_id not in appointment_history:
-        appointment_history[location_id] = []
+        return []
 
-    current_year = datetime.datetime.now().year
+    new_appointments = []
+    history = appointment_history.setdefault(location_id, {})
     for appointment in appointments:
-        formatted_start = format_timestamp(appointment["startTimestamp"])
-        if (
-            formatted_start not in appointment_history[location_id]
-            and str(current_year) in formatted_start
-        ):
-            notify(f"New appointment available on {formatted_start} in {city_name}")
-            heapq.heappush(appointment_history[location_id], formatted_start)
+        start = parse_timestamp(appointment["startTimestamp"])
+        if start.year != now.year:
+            continue
+        formatted_start = start.strftime(TIMESTAMP_FORMAT)
+        if formatted_start in history:
+            continue
+        new_appointments.append((formatted_start, city_name))
+        forget_appointments(
+            history_db,
+            location_id,
+            remember_appointment(location_id, formatted_start, start),
+        )
+    logger.info("Updated appointments for %s - %s", city_name, list(history))
+    return new_appointments
+
+
+def adapt_check_interval(location_id: int, new_count: int) -> float:
+    """
+    Updates the location's average of new appointments per check and returns
+    the check interval it calls for: shorter while appointments keep
+    appearing, longer while the location stays quiet.
+    """
+    hit_rate = (
+        HIT_RATE_DECAY * hit_rates.get(location_id, INITIAL_HIT_RATE)
+        + (1 - HIT_RATE_DECAY) * new_count
+    )
+    hit_rates[location_id] = hit_rate
+    busyness = (hit_rate - QUIET_HIT_RATE) / (BUSY_HIT_RATE - QUIET_HIT_RATE)
+    busyness = max(0.0, min(1.0, busyness))
+    return MAX_CHECK_INTERVAL * (MIN_CHECK_INTERVAL / MAX_CHECK_INTERVAL) ** busyness
+
+
+def remember_appointment(
+    location_id: int, formatted_start: str, start: datetime.datetime
+) -> List[str]:
+    """
+    Records a notified appointment in the in-memory history.
+    Returns the appointments evicted to make room for it.
+    """
+    history = appointment_history.setdefault(location_id, {})
+    evicted = list(history)[: max(0, len(history) - HISTORY_MAXLEN + 1)]
+    for formatted in evicted:
+        del history[formatted]
+    history[formatted_start] = start
+    return evicted
+
+
+def expire_appointments(location_id: int, now: datetime.datetime) -> List[str]:
+    """
+    Drops appointments that have already started from the in-memory history,
+    allowing HISTORY_EXPIRY_GRACE for the location's own timezone.
+    Returns the dropped appointments.
+    """
+    history = appointment_history.get(location_id, {})
+    cutoff = now - HISTORY_EXPIRY_GRACE
+    expired = [formatted for formatted, start in history.items() if start < cutoff]
+    for formatted in expired:
+        del history[formatted]
+    return expired
+
+
+def forget_appointments(
+    history_db: sqlite3.Connection, location_id: int, formatted_starts: List[str]
+) -> None:
+    """Deletes appointments that are no longer remembered from the history database."""
+    history_db.executemany(
+        "DELETE FROM seen WHERE lid = ? AND ts = ?",
+        [(location_id, formatted) for formatted in formatted_starts],
+    )
+
+
+def record_delivered_appointments(history_db: sqlite3.Connection) -> None:
+    """
+    Saves the appointments whose notification has been sent to the history
+    database. Appointments are only saved once notified, so that a failed
+    notification is sent again after a restart.
+    """
+    delivered = []
+    while True:
+        try:
+            delivered.append(delivered_appointments.get_nowait())
+        except queue.Empty:
+            break
+    history_db.executemany("INSERT OR IGNORE INTO seen VALUES (?, ?)", delivered)
+
+
+def open_history_db(path: Path = HISTORY_PATH) -> sqlite3.Connection:
+    """
+    Opens the persisted appointment history and loads it into memory,
+    so that a restart does not notify again about known appointments.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    history_db = sqlite3.connect(path)
+    now = datetime.datetime.now(CST)
+    with history_db:
+        history_db.execute(
+            "CREATE TABLE IF NOT EXISTS seen(lid INT, ts TEXT, PRIMARY KEY(lid, ts))"
+        )
+        rows = history_db.execute("SELECT lid, ts FROM seen ORDER BY rowid").fetchall()
+        for location_id, formatted_start in rows:
+            start = datetime.datetime.strptime(
+                formatted_start, TIMESTAMP_FORMAT
+            ).replace(tzinfo=CST)
+            forget_appointments(
+                history_db,
+                location_id,
+                remember_appointment(location_id, formatted_start, start),
+            )
+        for location_id in list(appointment_history):
+            forget_appointments(
+                history_db, location_id, expire_appointments(location_id, now)
+            )
     logger.info(
-        "Updated appointments for %s - %s",
-        city_name,
-        sorted(appointment_history[location_id]),
+        "Loaded %s appointments from %s",
+        sum(len(history) for history in appointment_history.values()),
+        path,
     )
-    return False
+    return history_db
 
 
 # Notification Options
-def notify(message: str) -> None:
-    """Notify based on the preferred method"""
+def notify(message: str, appointment_keys: Sequence[Tuple[int, str]] = ()) -> None:
+    """
+    Queues a notification for the notification worker to send. The
+    (location ID, formatted start) keys of the appointments it announces
+    are recorded as delivered once it has been sent.
+    """
 
     if (
         len(message.strip()) == 0
@@ -138,16 +400,67 @@ def notify(message: str) -> None:
 
     logger.info("🔔 Notification : %s", message)
 
+    try:
+        notification_queue.put_nowait((message, list(appointment_keys)))
+    except queue.Full:
+        logger.warning("Notification queue is full, dropping: %s", message)
+
+
+def send_notification(message: str) -> bool:
+    """Notify based on the preferred method. Returns True if it was sent."""
     try:
         # send_sms_notification(message)  # uncomment to enable SMS notifications
-        send_email_notification("Appointment Available", message)
+        return send_email_notification("Appointment Available", message)
     except ValueError as ve:
         logger.error("Invalid value: %s", str(ve))
+        return False
+
+
+def notification_worker() -> None:
+    """
+    Sends queued notifications until it receives None, then closes the
+    SMTP session, which only this thread uses.
+    """
+    while True:
+        item = notification_queue.get()
+        try:
+            if item is None:
+                close_smtp_session()
+                return
+            message, appointment_keys = item
+            if send_notification(message):
+                for key in appointment_keys:
+                    delivered_appointments.put(key)
+        except Exception:  # pylint: disable=broad-exception-caught
+            # Keep the only sending thread alive whatever goes wrong
+            logger.exception("Error sending notification: %s", item)
+        finally:
+            notification_queue.task_done()
+
+
+def start_notification_worker() -> threading.Thread:
+    """Starts the background thread that sends queued notifications."""
+    worker = threading.Thread(
+        target=notification_worker, name="notification-worker", daemon=True
+    )
+    worker.start()
+    return worker
+
+
+def stop_notification_worker(worker: threading.Thread) -> None:
+    """Lets the notification worker send the pending notifications, then stops it."""
+    try:
+        notification_queue.put(None, timeout=SMTP_TIMEOUT)
+    except queue.Full:
+        logger.warning("Notification queue is full, pending notifications are lost")
+        return
+    worker.join(timeout=SMTP_TIMEOUT)
 
 
-def send_email_notification(subject: str, message: str) -> None:
+def send_email_notification(subject: str, message: str) -> bool:
     """
     Sends an email notification.
+    Returns True if the email was sent.
     """
 
     # Validate input parameters
@@ -168,15 +481,54 @@ def send_email_notification(subject: str, message: str) -> None:
     msg.attach(MIMEText(message, "plain"))
 
     try:
-        # Connect to the SMTP server and send the email
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
+        get_smtp_session().send_message(msg)
+        logger.info("Email sent successfully!")
+        return True
+    except smtplib.SMTPServerDisconnected as e:
+        logger.error("Error sending email: %s", e)
+        close_smtp_session()  # reconnect on the next notification
+    except (smtplib.SMTPException, OSError) as e:
+        logger.error("Error sending email: %s", e)
+    return False
+
+
+def get_smtp_session() -> smtplib.SMTP:
+    """
+    Returns the shared SMTP session, connecting on first use and
+    reconnecting if the server has dropped it since the last notification.
+    """
+    global SMTP_SESSION  # pylint: disable=global-statement
+
+    if SMTP_SESSION is not None:
+        try:
+            if SMTP_SESSION.noop()[0] == 250:
+                return SMTP_SESSION
+        except (smtplib.SMTPException, OSError):
+            pass
+        close_smtp_session()
+
+    server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+    try:
         server.starttls()  # Secure the connection
         server.login(FROM_EMAIL, PASSWORD)
-        server.send_message(msg)
+    except BaseException:
+        server.close()
+        raise
+    SMTP_SESSION = server
+    return server
+
+
+def close_smtp_session() -> None:
+    """Closes the shared SMTP session, if one is open."""
+    global SMTP_SESSION  # pylint: disable=global-statement
+
+    server, SMTP_SESSION = SMTP_SESSION, None
+    if server is None:
+        return
+    try:
         server.quit()
-        logger.info("Email sent successfully!")
-    except smtplib.SMTPException as e:
-        logger.error("Error sending email: %s", e)
+    except (smtplib.SMTPException, OSError):
+        server.close()
 
 
 def send_sms_notification(message: str) -> NoReturn:
@@ -207,17 +559,38 @@ def send_sms_notification(message: str) -> NoReturn:
 
 
 # Utility Functions
+@functools.lru_cache(maxsize=4096)
+def parse_timestamp(timestamp: str) -> datetime.datetime:
+    """
+    Parses the ISO 8601 timestamp as CST. Timestamps without an offset, as
+    the API returns them, keep their wall-clock time instead of being read
+    in the host's local timezone.
+    """
+    try:
+        # fromisoformat only accepts a trailing "Z" from Python 3.11 onwards
+        parsed = datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        parsed = parser.parse(timestamp)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=CST)
+    return parsed.astimezone(CST)
+
+
 def format_timestamp(timestamp: str) -> str:
     """Formats the ISO 8601 timestamp into a more readable format and converts it to CST."""
-    cst_time = parser.parse(timestamp).astimezone(gettz("America/Chicago"))
-    return cst_time.strftime("%Y-%m-%d %H:%M CST")
+    return parse_timestamp(timestamp).strftime(TIMESTAMP_FORMAT)
+
+
+def normalize_city(city: str) -> str:
+    """Normalizes a city name for case-insensitive lookups."""
+    return city.strip().casefold()
 
 
 def lookup_by_city(
     locations_by_city: Dict[str, Dict[str, str]], city: str
 ) -> Optional[Dict[int, str]]:
     """Looks up location details by city name and returns a dictionary mapping ID to city."""
-    location_info = locations_by_city.get(city.lower())
+    location_info = locations_by_city.get(normalize_city(city))
     return (
         {int(location_info["id"]): location_info["city"]}
         if location_info
@@ -225,18 +598,84 @@ def lookup_by_city(
     )
 
 
-def main() -> NoReturn:
+def check_appointments(
+    executor: ThreadPoolExecutor,
+    location_details: Dict[int, str],
+    appointment_urls: Dict[int, str],
+    history_db: sqlite3.Connection,
+) -> float:
+    """
+    Checks all locations for new appointments.
+    Returns the number of seconds to wait before the next check.
+    """
+    futures = {
+        executor.submit(fetch_appointments, loc_id, appointment_urls[loc_id]): loc_id
+        for loc_id in location_details
+    }
+    failed = False
+    interval = MAX_CHECK_INTERVAL
+    new_appointments = []
+    appointment_keys = []
+    now = datetime.datetime.now(CST)  # once per check, not once per location
+    with history_db:  # commit the whole check in one transaction
+        record_delivered_appointments(history_db)
+        for future in as_completed(futures):
+            loc_id = futures[future]
+            appointments = future.result()
+            if appointments is FetchResult.NOT_MODIFIED:
+                # Still processed: which appointments are new also depends on `now`
+                logger.info("Appointments unchanged for %s", location_details[loc_id])
+                appointments = last_appointments.get(loc_id, [])
+            found = process_appointments(
+                loc_id, location_details[loc_id], appointments, history_db, now
+            )
+            new_appointments.extend(found)
+            appointment_keys.extend((loc_id, start) for start, _ in found)
+            if appointments is None:
+                failed = True  # not a quiet check, leave the hit rate alone
+            else:
+                interval = min(interval, adapt_check_interval(loc_id, len(found)))
+
+    if new_appointments:
+        # One notification per check, however many appointments were found
+        notify(
+            "New appointments available:\n"
+            + "\n".join(f"{start} in {city}" for start, city in new_appointments),
+            appointment_keys,
+        )
+    return ERROR_INTERVAL if failed else interval
+
+
+def request_check(_signum: int, _frame: object) -> None:
+    """Signal handler that interrupts the wait and checks for appointments now."""
+    logger.info("🔄 Check requested")
+    WAKE_EVENT.set()
+
+
+def request_stop(_signum: int, _frame: object) -> None:
+    """Signal handler that stops the scanner after the current check."""
+    logger.info("🛑 Stop requested")
+    STOP_EVENT.set()
+    WAKE_EVENT.set()
+
+
+def main() -> None:
     """Main function to run the scanner"""
 
+    signal.signal(signal.SIGTERM, request_stop)
+    if hasattr(signal, "SIGUSR1"):  # not available on Windows
+        signal.signal(signal.SIGUSR1, request_check)
+
     locations_by_city = fetch_locations()
     logger.info("Fetching available locations...")
     logger.info("Available cities: %s", ', '.join(sorted(locations_by_city.keys())).title())
 
     cities = input("Enter cities of interest (comma-separated): ").split(",")
+    wanted = [normalize_city(city) for city in cities]
     location_details = {
-        int(locations_by_city[city.strip().lower()]["id"]): city.strip()
-        for city in cities
-        if city.strip().lower() in locations_by_city
+        int(locations_by_city[city]["id"]): locations_by_city[city]["city"]
+        for city in wanted
+        if city in locations_by_city
     }
 
     logger.info("Location Details : %s", location_details)
@@ -245,16 +684,36 @@ def main() -> NoReturn:
         sys.exit(-1)
     logger.info("⏰ Checking for appointments...")
 
-    while True:
-        errors = [
-            process_appointments(loc_id, city)
-            for loc_id, city in location_details.items()
-        ]
-        logger.info(
-            "⏰ Waiting for %s seconds before next check...",
-            ERROR_INTERVAL if any(errors) else CHECK_INTERVAL,
-        )
-        time.sleep(ERROR_INTERVAL if any(errors) else CHECK_INTERVAL)
+    # The URLs only depend on the location, so build them once
+    appointment_urls = {loc_id: appointment_url(loc_id) for loc_id in location_details}
+    notifier = start_notification_worker()
+    try:
+        with closing(open_history_db()) as history_db, ThreadPoolExecutor(
+            max_workers=min(MAX_WORKERS, len(location_details))
+        ) as executor:
+            try:
+                while not STOP_EVENT.is_set():
+                    if not notifier.is_alive():
+                        logger.error("Notification worker stopped, restarting it")
+                        notifier = start_notification_worker()
+                    interval = check_appointments(
+                        executor, location_details, appointment_urls, history_db
+                    )
+                    if STOP_EVENT.is_set():
+                        break
+                    logger.info(
+                        "⏰ Waiting for %.0f seconds before next check...", interval
+                    )
+                    WAKE_EVENT.wait(timeout=interval)
+                    WAKE_EVENT.clear()
+            finally:
+                # Send what is pending and save it before the database closes
+                stop_notification_worker(notifier)
+                with history_db:
+                    record_delivered_appointments(history_db)
+    finally:
+        SESSION.close()
+    logger.info("🛑 Scanner stopped")
 
 
 if __name__ == "__main__":